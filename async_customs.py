@@ -0,0 +1,116 @@
+"""
+I load many snapshots concurrently with asyncio
+
+Customs.read() blocks on both the file read and the decode. Here the two are split:
+- file reads run in a thread pool, overlapping each other
+- decoding (CPU bound) runs in a process pool, so it is not serialized by the GIL
+- a semaphore bounds the snapshots in flight (read but not yet decoded). Reads wait for
+  decodes to finish, so a burst of requests never holds more than `limit` files in memory.
+
+    ac = AsyncCustoms(limit=4)
+    snapshots = await ac.read_many([("case_100", FileType.PICKLE), ("case_10000", FileType.MSGPACK)])
+    async for c in ac.as_completed(requests):
+        print(c.stem, len(c.id_dict))
+    ac.close()
+
+NOTES:
+- Decoded snapshots are pickled back from the decode processes. For small snapshots that
+  costs more than it saves - use decode_workers=0 to decode in the thread pool instead
+- aiofiles is not needed: a thread pool read is what it does underneath
+- Decode processes are started with forkserver/spawn (forking with live io threads can
+  deadlock), so scripts using them need the `if __name__ == "__main__":` guard
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from customs import Customs, FileType
+
+# (stem, FileType) of a snapshot to load
+Request = Tuple[str, FileType]
+
+
+def _read_file(fn: str) -> bytes:
+    with open(fn, "rb") as f:
+        return f.read()
+
+
+def _decode(stem: str, kind: FileType, data: bytes, translate: bool) -> Customs:
+    """ Decode a snapshot's bytes - runs in a decode worker """
+    c = Customs(stem, kind)
+    c.read(data)
+    if translate:
+        c.translate()
+    return c
+
+
+class AsyncCustoms:
+    """
+    I read snapshots concurrently, see module doc
+    """
+    def __init__(self, io_workers: int = 8, decode_workers: Optional[int] = None, limit: int = 8,
+                 translate: bool = False):
+        """
+        :param io_workers: threads reading files
+        :param decode_workers: processes decoding, None for one per cpu, 0 to decode in the io threads
+        :param limit: max snapshots in flight - read or being decoded
+        :param translate: also build all views (translate()) before returning each snapshot
+        """
+        self.io_workers = io_workers
+        self.decode_workers = decode_workers
+        self.limit = limit
+        self.translate = translate
+        # created on first use, so an unused AsyncCustoms costs nothing
+        self._io: Executor = None
+        self._decode: Executor = None
+
+    def _executors(self) -> Tuple[Executor, Executor]:
+        if not self._io:
+            self._io = ThreadPoolExecutor(self.io_workers, thread_name_prefix="customs-io")
+            if self.decode_workers == 0:
+                self._decode = self._io
+            else:
+                # not fork: the io threads are already running
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._decode = ProcessPoolExecutor(self.decode_workers, mp_context=multiprocessing.get_context(method))
+        return self._io, self._decode
+
+    def close(self) -> None:
+        """ Shut down the worker pools """
+        if self._decode and self._decode is not self._io:
+            self._decode.shutdown()
+        if self._io:
+            self._io.shutdown()
+        self._io = self._decode = None
+
+    async def _load(self, request: Request, slots: asyncio.Semaphore) -> Customs:
+        stem, kind = request
+        io_pool, decode_pool = self._executors()
+        loop = asyncio.get_running_loop()
+        async with slots:
+            data = await loop.run_in_executor(io_pool, _read_file, kind.path(stem))
+            return await loop.run_in_executor(decode_pool, _decode, stem, kind, data, self.translate)
+
+    def _tasks(self, requests: Iterable[Request]) -> List[asyncio.Task]:
+        slots = asyncio.Semaphore(self.limit)
+        return [asyncio.ensure_future(self._load(x, slots)) for x in requests]
+
+    async def read(self, stem: str, kind: FileType) -> Customs:
+        """ Load one snapshot """
+        return (await self.read_many([(stem, kind)]))[0]
+
+    async def read_many(self, requests: Iterable[Request]) -> List[Customs]:
+        """ Load all requests, returning the snapshots in request order """
+        return await asyncio.gather(*self._tasks(requests))
+
+    async def as_completed(self, requests: Iterable[Request]) -> AsyncIterator[Customs]:
+        """ Load all requests, yielding each snapshot as soon as it is decoded """
+        tasks = self._tasks(requests)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # the consumer stopped early or a load failed - don't leave loads running
+            for task in tasks:
+                task.cancel()
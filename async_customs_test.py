@@ -0,0 +1,55 @@
+"""
+Tests for async_customs module
+
+From project root:
+    pytest -s async_customs_test.py
+"""
+from unittest import IsolatedAsyncioTestCase
+
+from async_customs import AsyncCustoms
+from customs import Customs, FileType
+from tempdata import TempData
+
+
+class AsyncCustomsTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.data = TempData("case_100")
+        self.addCleanup(self.data.cleanup)
+        self.c = Customs("case_100", FileType.PICKLE)
+        self.c.read()
+        self.c.translate()
+        self.kinds = [FileType.PICKLE, FileType.MSGPACK, FileType.JSON, FileType.CSV]
+        for kind in self.kinds[1:]:
+            self.c.write(kind)
+        self.requests = [("case_100", kind) for kind in self.kinds]
+
+    async def test_read_many_threads(self):
+        ac = AsyncCustoms(decode_workers=0, limit=2, translate=True)
+        try:
+            snapshots = await ac.read_many(self.requests)
+        finally:
+            ac.close()
+        assert [x.filetype for x in snapshots] == self.kinds
+        for c in snapshots:
+            assert c.id_dict == self.c.id_dict
+            assert c.treenode == self.c.treenode
+
+    async def test_as_completed_processes(self):
+        ac = AsyncCustoms(decode_workers=2, limit=2)
+        try:
+            snapshots = [c async for c in ac.as_completed(self.requests)]
+        finally:
+            ac.close()
+        assert sorted(x.filetype.value for x in snapshots) == sorted(x.value for x in self.kinds)
+        for c in snapshots:
+            c.translate()
+            assert c.id_dict == self.c.id_dict
+
+    async def test_missing_file(self):
+        ac = AsyncCustoms(decode_workers=0)
+        try:
+            with self.assertRaises(FileNotFoundError):
+                await ac.read("no_such_case", FileType.JSON)
+        finally:
+            ac.close()
@@ -23,10 +23,13 @@ from argparse import RawDescriptionHelpFormatter
 from enum import Enum
 from pprint import pformat, pprint
 from timeit import default_timer as timer
-from typing import List
+from typing import Dict, List, Union
 
+import profiling
+import sweep
+from cache import SnapshotCache
 from customs import Customs, FileType
-from generator import CASE_INFO
+from generator import CASE_INFO, pickle_synthetic
 
 
 class BenchType(Enum):
@@ -38,14 +41,17 @@ class Bench:
     """
     I time things and report
     """
-    def __init__(self, kind: BenchType, case: str, file_types: List[FileType], iterations: int):
+    def __init__(self, kind: BenchType, case: str, file_types: List[FileType], iterations: int,
+                 cache: bool = False):
         self.kind: BenchType = kind
         self.case: str = case
         self.files_types: List[FileType] = file_types
         self.iterations: int = iterations
+        # read through a SnapshotCache - the first iteration loads (and translates), the rest hit
+        self.cache: bool = cache
         self.stats: List[str] = ["Case\tNodes\tDuration\tNodes/sec"]
 
-    def _add_stat(self, kind: FileType, duration: float) -> None:
+    def _add_stat(self, kind: Union[FileType, str], duration: float) -> None:
         nc = CASE_INFO[self.case]['nodes']
         nps = int(nc / duration)
         self.stats.append(f"{self.case}_{kind:18}\t{nc}\t{duration:.4f}\t{nps:>6}")
@@ -69,20 +75,28 @@ class Bench:
     
     def _time_read(self):
         self._create_read_targets(True)
+        cache = SnapshotCache() if self.cache else None
         for ft in self.files_types:
             c = Customs(self.case, ft)
+            read = (lambda: cache.get(self.case, ft)) if cache else c.read
             print(f"Intermediate times for {ft}:")
-            duration = 0
+            # with the cache, misses (read and translate) and hits are reported apart
+            durations: Dict[str, List[float]] = {}
             for _ in range(self.iterations):
+                misses = cache.stats()["misses"] if cache else 0
                 start = timer()
-                c.read()
+                read()
                 # TODO: add translate to better simulate actual operations - relatively small cost
                 # c.translate()
                 end = timer()
-                print(f"  {end-start:.3f}")
-                duration += end - start
+                outcome = "" if not cache else " miss" if cache.stats()["misses"] > misses else " hit"
+                print(f"  {end-start:.3f}{outcome}")
+                durations.setdefault(outcome, []).append(end - start)
 
-            self._add_stat(ft, duration / self.iterations)
+            for outcome, times in durations.items():
+                self._add_stat(f"{ft}{outcome}", sum(times) / len(times))
+        if cache:
+            print(f"Cache: {cache.stats()}")
 
     def validate(self):
         """
@@ -108,6 +122,7 @@ class Bench:
             others.append(c)
 
         for c in others:
+            assert c_pickle.merkle().root() == c.merkle().root()
             assert len(c_pickle.id_dict) == len(c.id_dict)
             assert c_pickle.id_dict == c.id_dict
             assert c_pickle.treenode == c.treenode
@@ -115,6 +130,36 @@ class Bench:
         print("===> All formats passed validation")
 
 
+def run_sweep(file_types: List[FileType], synthetic: List[int], iterations: int, out: str = None) -> None:
+    cases = [k for k in CASE_INFO if FileType.PICKLE.exists(k)]
+    for n in synthetic:
+        print(f"Generating synthetic_{n}")
+        cases.append(pickle_synthetic(n))
+
+    def progress(r: sweep.Result):
+        print(f"  {r.case:18}\t{r.operation:9}\t{r.file_type:10}\t{r.nodes}\t{r.seconds:.4f}\t{int(r.nodes_per_sec):>8}")
+
+    results = sweep.run(cases, file_types, iterations, progress)
+    fits = sweep.fit(results)
+    print()
+    print(sweep.plot(results, fits))
+    if out:
+        if out.endswith(".json"):
+            sweep.write_json(out, results, fits)
+        else:
+            sweep.write_csv(out, results)
+        print(f"Saved {out}")
+
+
+def run_profile(case: str, file_types: List[FileType], mode: str, operations: List[str], top: int,
+                out: str = None) -> None:
+    def progress(p: profiling.Profile):
+        print(p.format(top))
+        print()
+
+    profiling.run(case, file_types, mode, out or "./data/profile", operations, progress)
+
+
 def cases():
     hdr = "    Case        Nodes   Dirs   Files\n"
     return hdr + "\n".join([f"    {k:10} {v['dirs'] + v['files']:>6}  {v['dirs']:>5}  {v['files']:>6}" for k,v in CASE_INFO.items()])
@@ -136,12 +181,26 @@ USE:
     A fast, good indicator
         ./bench.py --read --case case_10000 -i3 -t all
 
+    Repeated reads of hot snapshots through the snapshot cache
+        ./bench.py --read --case case_10000 -i10 -t pickle json --cache
+
     A simpler test case
         ./bench.py --read --case case_100 -t all
 
     Develop a new serialization protocol - small file, single file type
         ./bench.py --read --case case_proj -t bson
 
+    Scaling sweep - every case with a local pickle plus synthetic sizes, flags formats
+    whose per node cost grows with N, saves the matrix as csv (or .json)
+        ./bench.py --sweep -t all --synthetic 10000 100000 1000000 -i3 -o sweep.csv
+
+    Profile read, write and translate - top functions by cumulative time, profiles saved
+    to ./data/profile (or -o dir): .pstats for cprofile, collapsed stacks (flame graphs)
+    for sampling and tracemalloc
+        ./bench.py --profile cprofile --case case_10000 -t msgpack json
+        ./bench.py --profile sampling --case synthetic_100000 -t all --operations read --top 25
+        ./bench.py --profile tracemalloc --case case_10000 -t pickle
+
 FILE TYPES:
     {", ".join(sorted(FileType.__members__.keys()))}
 
@@ -170,6 +229,13 @@ def main():
                           action='store_true',
                           default=False,
                           help='Check serialization for correctness')
+    subjects.add_argument('-s', '--sweep',
+                          action='store_true',
+                          default=False,
+                          help='Time read, write, translate across all case sizes')
+    subjects.add_argument('-p', '--profile',
+                          choices=profiling.MODES,
+                          help='Profile read, write, translate for each file type')
     # Common params
     parser.add_argument('-i', '--iterations',
                         type=int,
@@ -183,6 +249,28 @@ def main():
                         nargs='+',
                         metavar="FT",
                         help='Which file types. E.g. pickle csv. Use "all" to cover all formats, "best" for best performers')
+    parser.add_argument('--synthetic',
+                        nargs='+',
+                        type=int,
+                        default=[],
+                        metavar="N",
+                        help='Sweep: also generate and time synthetic cases of N nodes')
+    parser.add_argument('-o', '--out',
+                        help='Sweep: save results to this .csv or .json file. Profile: save profiles in this directory')
+    parser.add_argument('--operations',
+                        nargs='+',
+                        choices=profiling.OPERATIONS,
+                        default=list(profiling.OPERATIONS),
+                        help='Profile: which operations')
+    parser.add_argument('--top',
+                        type=int,
+                        default=profiling.TOP,
+                        metavar="N",
+                        help='Profile: how many functions to print')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        default=False,
+                        help='Read through the snapshot cache (misses include translate)')
     args = parser.parse_args()
     
     if args.validate:
@@ -191,7 +279,12 @@ def main():
         exit(0)
     
     file_types = []
-    if 'all' in args.file_types:
+    if not args.file_types:
+        if not args.sweep:
+            print("file types are required, e.g. -t pickle csv")
+            exit(1)
+        file_types = FileType.all()
+    elif 'all' in args.file_types:
         file_types = FileType.all()
     elif 'best' in args.file_types:
         file_types = FileType.best()
@@ -206,11 +299,22 @@ def main():
         print(f"Invalid iterations: {args.iterations}")
         exit(1)
 
+    if args.sweep:
+        run_sweep(file_types, args.synthetic, args.iterations, args.out)
+        exit(0)
+
+    if args.profile:
+        if not args.case or not FileType.PICKLE.exists(args.case):
+            print("profile needs a case with a pickle, e.g. --case case_10000")
+            exit(1)
+        run_profile(args.case, file_types, args.profile, args.operations, args.top, args.out)
+        exit(0)
+
     bt = BenchType.WRITE
     if args.read:
         bt = BenchType.READ
 
-    b = Bench(bt, args.case, file_types, args.iterations)
+    b = Bench(bt, args.case, file_types, args.iterations, args.cache)
     b.timeit()
     b.report()
 
@@ -0,0 +1,152 @@
+"""
+I keep decoded snapshots in memory, shared by every caller in the process
+
+Snapshots are keyed by (stem, FileType, file mtime, file size), so rewriting a snapshot
+file is a miss - the stale entry is dropped, never returned.
+
+Memory budget: each entry is charged an estimate of its decoded size (nodes * NODE_BYTES,
+see compact_speed_test.py for measured bytes per node). When the total goes over budget,
+the least recently used entries are evicted. A snapshot larger than the whole budget is
+returned but not kept.
+
+Second level (optional): a directory of decoded snapshots, kept as pickled TreeNodes - the
+fastest format to restore. A miss in memory for a snapshot in a slow format (json, csv, ...)
+loads the pickle instead of decoding the source again. Each file is stamped with its
+source's mtime/size (see sidecar), so stale ones are rebuilt.
+
+    cache = SnapshotCache(budget=256 * 1024 * 1024, l2_dir="/tmp/snapshots")
+    c = cache.get("case_10000", FileType.JSON)
+    print(cache.stats())
+
+NOTES:
+- Cached Customs are shared - treat them as read only
+- Thread safe, but two threads missing on the same snapshot both load it
+"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import sidecar
+from customs import Customs, FileType
+
+# Estimated bytes per node of a translated snapshot (Node, TreeNode, id_dict, tn_dict)
+NODE_BYTES = 750
+DEFAULT_BUDGET = 512 * 1024 * 1024
+
+# (stem, FileType, mtime_ns, size)
+CacheKey = Tuple[str, FileType, int, int]
+
+
+class CacheEntry(NamedTuple):
+    customs: Customs
+    cost: int
+
+
+class SnapshotCache:
+    """
+    I am a memory bounded LRU cache of translated snapshots, see module doc
+    """
+    def __init__(self, budget: int = DEFAULT_BUDGET, l2_dir: Optional[str] = None):
+        """
+        :param budget: bytes of decoded snapshots to keep in memory
+        :param l2_dir: keep decoded snapshots here too, None for no second level
+        """
+        self.budget = budget
+        self.l2_dir = l2_dir
+        if l2_dir:
+            Path(l2_dir).mkdir(parents=True, exist_ok=True)
+        # least recently used first
+        self.entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _l2_path(self, stem: str, kind: FileType) -> str:
+        return f"{self.l2_dir}/{stem}.{kind.value}.pickle"
+
+    def _load(self, stem: str, kind: FileType) -> Customs:
+        """ Read and translate a snapshot, from the second level when it is current """
+        source = kind.path(stem)
+        if self.l2_dir and kind != FileType.PICKLE:
+            treenode = sidecar.load(self._l2_path(stem, kind), source)
+            if treenode:
+                c = Customs(stem, kind)
+                c.treenode = treenode
+                c.translate()
+                with self._lock:
+                    self.l2_hits += 1
+                return c
+
+        c = Customs(stem, kind)
+        c.read()
+        c.translate()
+        if self.l2_dir and kind != FileType.PICKLE:
+            sidecar.save(self._l2_path(stem, kind), source, c.treenode)
+        return c
+
+    def get(self, stem: str, kind: FileType) -> Customs:
+        """ The translated snapshot - from memory if it is current, else loaded and cached """
+        key = (stem, kind, *sidecar.stamp(kind.path(stem)))
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry.customs
+            self.misses += 1
+
+        c = self._load(stem, kind)
+        cost = len(c.id_dict) * NODE_BYTES
+        with self._lock:
+            # an older version of this snapshot is never wanted again
+            for old in [k for k in self.entries if k[:2] == key[:2] and k != key]:
+                self._remove(old)
+            if cost <= self.budget and key not in self.entries:
+                self.entries[key] = CacheEntry(c, cost)
+                self.used += cost
+                while self.used > self.budget:
+                    self._remove(next(iter(self.entries)))
+                    self.evictions += 1
+        return c
+
+    def _remove(self, key: CacheKey) -> None:
+        self.used -= self.entries.pop(key).cost
+
+    def invalidate(self, stem: str, kind: FileType = None) -> None:
+        """ Drop a snapshot (all file types unless kind) from memory """
+        with self._lock:
+            for key in [k for k in self.entries if k[0] == stem and (kind is None or k[1] == kind)]:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.used = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "used": self.used,
+                "budget": self.budget,
+                "hits": self.hits,
+                "l2_hits": self.l2_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# The process wide cache
+_cache: SnapshotCache = None
+
+
+def snapshot_cache() -> SnapshotCache:
+    """ The process wide cache, created with the default budget on first use """
+    global _cache
+    if not _cache:
+        _cache = SnapshotCache()
+    return _cache
@@ -0,0 +1,77 @@
+"""
+Tests for cache module
+
+From project root:
+    pytest -s cache_test.py
+"""
+import os
+import tempfile
+from unittest import TestCase
+
+import cache
+from cache import SnapshotCache
+from customs import Customs, FileType
+from tempdata import TempData
+
+
+class SnapshotCacheTest(TestCase):
+
+    def setUp(self):
+        self.data = TempData("case_100")
+        self.addCleanup(self.data.cleanup)
+        self.c = Customs("case_100", FileType.PICKLE)
+        self.c.read()
+        self.c.translate()
+        for kind in (FileType.JSON, FileType.MSGPACK):
+            self.c.write(kind)
+        self.cost = len(self.c.id_dict) * cache.NODE_BYTES
+
+    def test_hit(self):
+        sc = SnapshotCache()
+        first = sc.get("case_100", FileType.JSON)
+        assert first.treenode == self.c.treenode
+        assert sc.get("case_100", FileType.JSON) is first
+        stats = sc.stats()
+        assert (stats["hits"], stats["misses"], stats["used"]) == (1, 1, self.cost)
+
+    def test_stale(self):
+        sc = SnapshotCache()
+        first = sc.get("case_100", FileType.JSON)
+        fn = FileType.JSON.path("case_100")
+        stats = os.stat(fn)
+        os.utime(fn, ns=(stats.st_atime_ns, stats.st_mtime_ns + 1000))
+        assert sc.get("case_100", FileType.JSON) is not first
+        assert sc.stats()["entries"] == 1
+
+    def test_eviction(self):
+        # room for one snapshot - each get evicts the other
+        sc = SnapshotCache(budget=self.cost)
+        sc.get("case_100", FileType.JSON)
+        sc.get("case_100", FileType.MSGPACK)
+        assert [k[1] for k in sc.entries] == [FileType.MSGPACK]
+        sc.get("case_100", FileType.JSON)
+        stats = sc.stats()
+        assert (stats["misses"], stats["evictions"], stats["used"]) == (3, 2, self.cost)
+
+        # too large to keep at all
+        sc = SnapshotCache(budget=self.cost - 1)
+        assert sc.get("case_100", FileType.JSON).id_dict == self.c.id_dict
+        assert sc.stats()["entries"] == 0
+
+    def test_invalidate(self):
+        sc = SnapshotCache()
+        sc.get("case_100", FileType.JSON)
+        sc.get("case_100", FileType.MSGPACK)
+        sc.invalidate("case_100", FileType.JSON)
+        assert [k[1] for k in sc.entries] == [FileType.MSGPACK]
+        sc.invalidate("case_100")
+        assert sc.stats()["used"] == 0
+
+    def test_l2(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            SnapshotCache(l2_dir=tmp).get("case_100", FileType.JSON)
+            sc = SnapshotCache(l2_dir=tmp)
+            c = sc.get("case_100", FileType.JSON)
+            assert sc.stats()["l2_hits"] == 1
+            assert c.treenode == self.c.treenode
+            assert c.id_dict == self.c.id_dict
@@ -18,7 +18,8 @@ from pprint import pprint
 from typing import Callable, Iterable, Dict, Set, List, Union
 
 from customs import Customs, FileType
-from node import Node
+from index import NodeIndex
+from node import Node, TreeNode
 
 
 # classificatino rule example
@@ -35,11 +36,13 @@ class Classifier:
     Classifications may be specified by:
     - id
     - rule (predicate)
+    - query (NodeIndex criteria) - resolved through indexes instead of a scan
     """
     def __init__(self):
         self.result: Dict[str, Set] = defaultdict(set)
         self._id_rules: Dict[str, List[int]] = defaultdict(list)
         self._predicate_rules: Dict[str, List[Callable]] = defaultdict(list)
+        self._query_rules: Dict[str, List[Dict]] = defaultdict(list)
 
     def add_id(self, label: str, id: Union[int, List[int]]) -> None:
         if not isinstance(id, list):
@@ -54,21 +57,50 @@ class Classifier:
                    return n.id in {id1, id2, ...}
         """
         self._predicate_rules[label].append(predicate)
+
+    def add_query(self, label: str, **criteria) -> None:
+        """
+        :param criteria - NodeIndex.query() criteria, e.g.
+               add_query("big-py", extension="py", size=(1 << 20, None))
+        """
+        self._query_rules[label].append(criteria)
     
-    def classify(self, nodes: Dict[int, Node]) -> None:
+    def classify(self, nodes: Union[Dict[int, Node], TreeNode], index: NodeIndex = None) -> None:
+        """
+        :param nodes - an id_dict, or a TreeNode which is only converted to an id_dict
+               if id or query rules need one
+        :param index - indexes over nodes (e.g. Customs.node_index()), built here if
+               query rules need one and none is provided
+        """
         self.result = defaultdict(set)
+        treenode = None
+        if isinstance(nodes, TreeNode):
+            treenode = nodes
+            if self._id_rules or (self._query_rules and index is None):
+                nodes = treenode.to_id_dict()
         
         # Collect by id
         for k,v in self._id_rules.items():
             for id in v:
                 self.result[k].add(nodes[id])
+
+        # Collect by query
+        if self._query_rules and index is None:
+            index = NodeIndex(nodes)
+        for label, queries in self._query_rules.items():
+            for criteria in queries:
+                self.result[label].update(index.nodes(index.query(**criteria)))
         
         # Collect by predicate
-        for n in nodes.values():
-            for label, predicates in self._predicate_rules.items():
-                for predicate in predicates:
-                    if predicate(n):
-                        self.result[label].add(n)
+        if not self._predicate_rules:
+            return
+        batches = treenode.node_batches() if treenode else [nodes.values()]
+        for batch in batches:
+            for n in batch:
+                for label, predicates in self._predicate_rules.items():
+                    for predicate in predicates:
+                        if predicate(n):
+                            self.result[label].add(n)
 
     def print(self):
         for k,v in self.result.items():
@@ -86,6 +118,7 @@ cl.add_id("specific", 9775968)
 cl.add_id("specific", [9775967, 9775965])
 cl.add_rule("py-files", lambda x: x.extension == "py")
 cl.add_rule("big-files", lambda x: x.size > 10000)
+cl.add_query("big-py-files", extension="py", size=(10000, None))
 
-cl.classify(c.id_dict)
+cl.classify(c.id_dict, c.node_index())
 cl.print()
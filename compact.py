@@ -0,0 +1,214 @@
+"""
+I provide compact alternatives to the Node and TreeNode NamedTuples
+
+At 1M nodes the NamedTuple views cost several hundred bytes per node. Two savings:
+
+SlotNode: a __slots__ class (no per instance __dict__)
+- tag and the 3 perm fields are packed into one small int: mode
+- stem, extension are derived from name on access instead of stored
+- 11 slots instead of 16 tuple fields, and 3 fewer str objects per node
+
+CompactTree: the hierarchy as flat lists and index ranges instead of a list pair per dir
+- dirs are stored breadth first, so each dir's child dirs are a contiguous range
+- files are stored grouped by dir, so each dir's files are a contiguous range
+- the ranges are 4 array('q') columns - 32 bytes per dir
+
+See compact_speed_test.py for bytes per node and read speed against the NamedTuples.
+
+NOTES:
+- A read side representation - writers need the NamedTuple views (to_treenode())
+- SlotNode is immutable by convention only
+"""
+from array import array
+from collections import deque
+from enum import Enum
+from typing import Dict, Iterator, List, Optional, Union
+
+from node import Node, TreeNode
+
+# mode bit set for directories, below it: owner, group, other perms - 3 bits each
+_DIR_BIT = 1 << 9
+
+
+class Representation(Enum):
+    """ How Customs holds a snapshot after translate() """
+    NAMEDTUPLE = 'namedtuple'  # Node, TreeNode, id_dict, tn_dict
+    COMPACT = 'compact'  # CompactTree of SlotNodes
+
+
+class SlotNode:
+    """
+    Node equivalent with packed fields, see module doc
+    """
+    __slots__ = ("id", "name", "parent_id", "path", "size", "owner", "group",
+                 "created", "accessed", "modified", "mode")
+
+    def __init__(self, id: int, name: str, parent_id: Optional[int], path: str, size: int, owner: int,
+                 group: int, created: int, accessed: int, modified: int, mode: int):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.path = path
+        self.size = size
+        self.owner = owner
+        self.group = group
+        self.created = created
+        self.accessed = accessed
+        self.modified = modified
+        self.mode = mode
+
+    @staticmethod
+    def from_node(n: Node) -> "SlotNode":
+        mode = (_DIR_BIT if n.is_dir() else 0) | n.owner_perm << 6 | n.group_perm << 3 | n.other_perm
+        return SlotNode(n.id, n.name, n.parent_id, n.path, n.size, n.owner, n.group,
+                        n.created, n.accessed, n.modified, mode)
+
+    def to_node(self) -> Node:
+        mode = self.mode
+        return Node(self.id, self.tag, self.name, self.parent_id, self.stem, self.extension, self.path,
+                    self.size, self.owner, self.group, self.created, self.accessed, self.modified,
+                    mode >> 6 & 7, mode >> 3 & 7, mode & 7)
+
+    def is_dir(self) -> bool:
+        return bool(self.mode & _DIR_BIT)
+
+    @property
+    def tag(self) -> str:
+        return "Directory" if self.mode & _DIR_BIT else "File"
+
+    @property
+    def stem(self) -> str:
+        dot = self.name.rfind(".")
+        return self.name[:dot] if 0 < dot < len(self.name) - 1 else self.name
+
+    @property
+    def extension(self) -> str:
+        dot = self.name.rfind(".")
+        return self.name[dot + 1:] if 0 < dot < len(self.name) - 1 else ""
+
+    @property
+    def owner_perm(self) -> int:
+        return self.mode >> 6 & 7
+
+    @property
+    def group_perm(self) -> int:
+        return self.mode >> 3 & 7
+
+    @property
+    def other_perm(self) -> int:
+        return self.mode & 7
+
+    def __eq__(self, other):
+        return isinstance(other, SlotNode) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return f"{self.name}   ({self.tag}: {self.path})"
+
+    def __repr__(self):
+        return f"SlotNode{self.to_node().__repr__()}"
+
+
+AnyNode = Union[Node, SlotNode]
+
+
+class CompactTree:
+    """
+    TreeNode equivalent, see module doc. Dirs are addressed by their index in dirs, the root is 0.
+
+        ct = CompactTree.from_treenode(c.treenode)
+        for i in ct.child_dirs(0):
+            print(ct.dirs[i], len(ct.dir_files(i)))
+    """
+    def __init__(self, dirs: List[AnyNode], files: List[AnyNode], child_start: array, child_count: array,
+                 file_start: array, file_count: array):
+        self.dirs = dirs
+        self.files = files
+        self.child_start = child_start
+        self.child_count = child_count
+        self.file_start = file_start
+        self.file_count = file_count
+        # Node.id -> dir index, built on first lookup
+        self._dir_index: Dict[int, int] = None
+
+    @staticmethod
+    def from_treenode(root: TreeNode, slots: bool = True) -> "CompactTree":
+        """
+        :param slots: convert Nodes to SlotNodes, otherwise keep (share) the Node tuples
+        """
+        convert = SlotNode.from_node if slots else (lambda x: x)
+        dirs = []
+        files = []
+        child_start = array('q')
+        child_count = array('q')
+        file_start = array('q')
+        file_count = array('q')
+        # breadth first: a dir's children are queued together, so they get consecutive indexes
+        queue = deque([root])
+        next_index = 1
+        while queue:
+            tn = queue.popleft()
+            dirs.append(convert(tn.me))
+            child_start.append(next_index)
+            child_count.append(len(tn.dirs))
+            next_index += len(tn.dirs)
+            file_start.append(len(files))
+            file_count.append(len(tn.files))
+            files.extend(convert(x) for x in tn.files)
+            queue.extend(tn.dirs)
+        return CompactTree(dirs, files, child_start, child_count, file_start, file_count)
+
+    def to_treenode(self) -> TreeNode:
+        """ Rebuild the NamedTuple hierarchy - e.g. to write a compact snapshot """
+        def node(x: AnyNode) -> Node:
+            return x if isinstance(x, Node) else x.to_node()
+
+        tns = [TreeNode(me=node(d), files=[node(x) for x in self.dir_files(i)], dirs=[])
+               for i, d in enumerate(self.dirs)]
+        for i, tn in enumerate(tns):
+            tn.dirs.extend(tns[j] for j in self.child_dirs(i))
+        return tns[0]
+
+    def __len__(self):
+        return len(self.dirs) + len(self.files)
+
+    def child_dirs(self, i: int) -> range:
+        """ indexes of dir i's child dirs """
+        start = self.child_start[i]
+        return range(start, start + self.child_count[i])
+
+    def dir_files(self, i: int) -> List[AnyNode]:
+        start = self.file_start[i]
+        return self.files[start:start + self.file_count[i]]
+
+    def dir_index(self, id: int) -> int:
+        if self._dir_index is None:
+            self._dir_index = {d.id: i for i, d in enumerate(self.dirs)}
+        return self._dir_index[id]
+
+    def node_iter(self, i: int = 0) -> Iterator[AnyNode]:
+        """ Same pre-order as TreeNode.node_iter(), from dir i """
+        stack = [i]
+        while stack:
+            i = stack.pop()
+            yield self.dirs[i]
+            start = self.file_start[i]
+            yield from self.files[start:start + self.file_count[i]]
+            stack.extend(reversed(self.child_dirs(i)))
+
+    def node_counts(self, i: int = 0):
+        """ Return the count of dirs, files under dir i (inclusive) """
+        dirs = 0
+        files = 0
+        stack = [i]
+        while stack:
+            i = stack.pop()
+            dirs += 1
+            files += self.file_count[i]
+            stack.extend(self.child_dirs(i))
+        return dirs, files
+
+    def __eq__(self, other):
+        return isinstance(other, CompactTree) and list(self.node_iter()) == list(other.node_iter())
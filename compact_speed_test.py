@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare memory per node and read speed of the NamedTuple and compact representations
+
+Memory is measured with tracemalloc while unpickling each representation, so all of the
+str/int objects it owns are counted - not just the containers.
+
+From project root:
+    ./compact_speed_test.py --case case_10000
+"""
+import argparse
+import pickle
+import tracemalloc
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict
+
+from compact import CompactTree
+from customs import Customs, FileType
+
+
+def _bytes(obj: Any) -> int:
+    """ Bytes allocated to rehydrate obj """
+    data = pickle.dumps(obj, protocol=-1)
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    loaded = pickle.loads(data)
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del loaded
+    return end - start
+
+
+def _time(func: Callable, iterations: int) -> float:
+    start = timer()
+    for _ in range(iterations):
+        func()
+    return (timer() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per node and read speed by representation")
+    parser.add_argument('-c', '--case',
+                        default="case_10000",
+                        help='pickled case to load')
+    parser.add_argument('-i', '--iterations',
+                        type=int,
+                        default=10,
+                        help='how many times to time each read')
+    args = parser.parse_args()
+
+    c = Customs(args.case, FileType.PICKLE)
+    c.read()
+    c.translate()
+    count = len(c.id_dict)
+
+    reps: Dict[str, Any] = {
+        "treenode": c.treenode,
+        "customs_views": (c.treenode, c.id_dict, c.tn_dict),
+        "compact_node": CompactTree.from_treenode(c.treenode, slots=False),
+        "compact_slots": CompactTree.from_treenode(c.treenode),
+    }
+    scans = {
+        "treenode": lambda: sum(x.size for x in c.treenode.node_iter()),
+        "customs_views": lambda: sum(x.size for x in c.id_dict.values()),
+        "compact_node": lambda: sum(x.size for x in reps["compact_node"].node_iter()),
+        "compact_slots": lambda: sum(x.size for x in reps["compact_slots"].node_iter()),
+    }
+    # all representations must agree before we compare them
+    assert len({f() for f in scans.values()}) == 1
+
+    print(f"Representation\tNodes\tBytes/node\tScan sec\tNodes/sec")
+    for name, rep in reps.items():
+        per_node = _bytes(rep) / count
+        duration = _time(scans[name], args.iterations)
+        print(f"{name:14}\t{count}\t{per_node:>8.1f}\t{duration:.4f}\t{int(count / duration):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Tests for compact module
+
+From project root:
+    pytest -s compact_test.py
+"""
+from unittest import TestCase
+
+from compact import CompactTree, Representation, SlotNode
+from customs import Customs, FileType
+from tempdata import TempData
+
+
+class CompactTest(TestCase):
+
+    def setUp(self):
+        self.c = Customs("case_10000", FileType.PICKLE)
+        self.c.read()
+        self.c.translate()
+
+    def test_slot_node(self):
+        for node in self.c.id_dict.values():
+            slot = SlotNode.from_node(node)
+            assert slot.to_node() == node
+            assert (slot.tag, slot.stem, slot.extension, slot.owner_perm, slot.group_perm, slot.other_perm) == \
+                (node.tag, node.stem, node.extension, node.owner_perm, node.group_perm, node.other_perm)
+
+    def test_compact_tree(self):
+        for slots in (True, False):
+            ct = CompactTree.from_treenode(self.c.treenode, slots=slots)
+            assert ct.to_treenode() == self.c.treenode
+            assert ct.node_counts() == self.c.treenode.node_counts()
+            nodes = [x.to_node() if slots else x for x in ct.node_iter()]
+            assert nodes == list(self.c.treenode.node_iter())
+            for id, tn in self.c.tn_dict.items():
+                i = ct.dir_index(id)
+                assert [x.id for x in ct.dir_files(i)] == [x.id for x in tn.files]
+                assert [ct.dirs[j].id for j in ct.child_dirs(i)] == [x.me.id for x in tn.dirs]
+
+    def test_customs_representation(self):
+        c = Customs("case_10000", FileType.PICKLE, Representation.COMPACT)
+        c.read()
+        c.translate()
+        assert c.treenode is None and not c.id_dict
+        assert c.compact.to_treenode() == self.c.treenode
+
+    def test_customs_compact_write(self):
+        data = TempData("case_100")
+        try:
+            c = Customs("case_100", FileType.PICKLE, Representation.COMPACT)
+            c.read()
+            c.translate()
+            compact = c.compact
+            c.write(FileType.MSGPACK)
+            # still compact
+            assert c.compact is compact and c.treenode is None
+            with self.assertRaises(ValueError):
+                c.rollup()
+            with self.assertRaises(ValueError):
+                c.merkle()
+
+            m = Customs("case_100", FileType.MSGPACK)
+            m.read()
+            assert m.treenode == compact.to_treenode()
+
+            # a new read drops the old CompactTree
+            c.read()
+            assert c.compact is None
+            c.translate()
+            assert c.compact is not compact and c.compact == compact
+        finally:
+            data.cleanup()
@@ -10,7 +10,8 @@ Serialization concerns
       to translate all existing archives
     - change field order - if we don't store field name information, do we break all existing archives
     - add/remove fields - no field names makes this difficult
-- solid impl - msgpack blows up on large files - need to set max_xxx_len according to file size - case_home blows up
+- solid impl - msgpack blew up on large files (one huge array hits max_xxx_len) - case_home blew up.
+  We now write a stream of per node maps and read them with a streaming Unpacker sized from the file.
 - format stability - will file format change if version changes. bloscpack announces they may change format with
   no backwards compatibility. Pickle provides a protocol to version archives.
 
@@ -19,26 +20,31 @@ Lists of protocols
 - OLD https://gist.github.com/cactus/4073643
 """
 import argparse
-import csv
-import json
-import pickle
-import ujson
+import io
+import mmap
+import tempfile
 from argparse import RawDescriptionHelpFormatter
 from collections import defaultdict
+from contextlib import contextmanager
 from enum import Enum
 from pathlib import Path
 from timeit import default_timer as timer
-from typing import Callable, Dict, Union
-
-from bson import CodecOptions, BSON, decode_file_iter
-import cbor
-import cbor2
-import msgpack
-import rapidjson
-import simplejson
-from bson.raw_bson import RawBSONDocument
-
+from typing import TYPE_CHECKING, Any, Callable, Dict, IO, Iterator, List, Optional, Union
+
+import formats
+import records
+import sidecar
+from compact import CompactTree, Representation
+from formats import Format
+from index import NodeIndex
+from merkle import Merkle
 from node import Node, TreeNode
+from rollup import Rollups
+
+if TYPE_CHECKING:
+    from lazybson import LazyNode
+    from neo4jcsv import Export
+    from sqlitedb import SqliteSnapshot
 
 
 class FileType(Enum):
@@ -48,14 +54,22 @@ class FileType(Enum):
     Out[20]: './data/pickle/case_100.pickle'
     """
     PICKLE = 'pickle'
+    PICKLE5 = 'pickle5'
     BSON = 'bson'
     CBOR = 'cbor'
     CBOR2 = 'cbor2'
     CSV = 'csv'
+    TSV = 'tsv'
     JSON = 'json'
     MSGPACK = 'msgpack'
+    MSGSPEC_JSON = 'msgspec_json'
+    MSGSPEC_MSGPACK = 'msgspec_msgpack'
+    NDJSON = 'ndjson'
+    ORJSON = 'orjson'
     RAPIDJSON = 'rapidjson'
     SIMPLEJSON = 'simplejson'
+    SQLITE = 'sqlite'
+    STRUCT = 'struct'
     UJSON = 'ujson'
     
     @staticmethod
@@ -66,13 +80,22 @@ class FileType(Enum):
     def all_but_pickle():
         return [x for x in FileType.__members__.values() if x != FileType.PICKLE]
     
+    @staticmethod
+    def records():
+        """ Formats written as one document per node - these support an index footer """
+        return [x for x in FileType.__members__.values() if formats.get(x.value).records]
+
     @staticmethod
     def best():
-        poor_perf = [FileType.CSV, FileType.CBOR, FileType.CBOR2]
+        poor_perf = [FileType.CBOR, FileType.CBOR2]
         return [x for x in FileType.__members__.values() if x not in poor_perf]
     
     def path(self, stem: str) -> str:
         return f"./data/{self.value}/{stem}.{self.value}"
+
+    def sidecar(self, stem: str, suffix: str) -> str:
+        """ Path for data persisted alongside a snapshot, e.g. ./data/pickle/case_100.rollup """
+        return f"./data/{self.value}/{stem}.{suffix}"
     
     def exists(self, stem: str) -> bool:
         return Path(self.path(stem)).exists()
@@ -84,14 +107,10 @@ class NodeStats:
             return dict(files=0, dirs=0)
         self.stats = defaultdict(new_key)
 
-    def _calculate_treenode(self, label: str, collection: TreeNode):
-        # TODO: make TreeNode support iter()
-        if not collection.me.parent_id:
-            self.stats[label]['dirs'] = 1
-        self.stats[label]['dirs'] += len(collection.dirs)
-        self.stats[label]['files'] += len(collection.files)
-        for d in collection.dirs:
-            self._calculate_treenode(label, d)
+    def _calculate_treenode(self, label: str, collection: Union[TreeNode, CompactTree]):
+        dirs, files = collection.node_counts()
+        self.stats[label]['dirs'] += dirs
+        self.stats[label]['files'] += files
 
     def _calculate_dict(self, label: str, collection: Dict):
         for node in collection.values():
@@ -100,8 +119,8 @@ class NodeStats:
             else:
                 self.stats[label]['files'] += 1
 
-    def add(self, label: str, collection: Union[Dict, TreeNode]):
-        if isinstance(collection, TreeNode):
+    def add(self, label: str, collection: Union[Dict, TreeNode, CompactTree]):
+        if isinstance(collection, (TreeNode, CompactTree)):
             self._calculate_treenode(label, collection)
         else:
             self._calculate_dict(label, collection)
@@ -132,17 +151,20 @@ class Customs:
     - BSON:
     """
     
-    def __init__(self, stem: str, source_kind: FileType):
+    def __init__(self, stem: str, source_kind: FileType, representation: Representation = Representation.NAMEDTUPLE):
         self.stem = stem
         self.filetype = source_kind
+        self.representation = representation
         
         # Our 3 data formats are views into the same collection of Nodes for size/speed
         # - change one Node, change all collections
-        self.treenode: TreeNode = None
+        # Readers set one (the source), the others are built from it on first access - see the
+        # treenode, id_dict, tn_dict properties. Setting a view invalidates the others.
+        self._treenode: TreeNode = None
         # Node.id -> Node
-        self.id_dict: Dict[int, Node] = {}
+        self._id_dict: Dict[int, Node] = None
         # Node.id -> TreeNode (only dirs)
-        self.tn_dict: Dict[int, TreeNode] = {}
+        self._tn_dict: Dict[int, TreeNode] = None
         
         # The easiest format to serialize - keep it around just so we can take it out of the equation
         self.dict_list = None
@@ -152,223 +174,414 @@ class Customs:
         # but it is always slower than others
         # TODO: toggle this to radically change json performance
         self.json_dict_list = True
+
+        # read(data): the file contents to decode in place of the file
+        self._data: bytes = None
+
+        # Parse CSV/TSV in chunks with pandas when it is installed - csv.reader otherwise
+        self.csv_pandas = False
+
+        # Layout: write nodes in TreeNode.node_iter() pre-order, so every dir's subtree is
+        # contiguous. translate() then rebuilds the hierarchy with one stack pass instead of
+        # tn_dict lookups - falling back to them for files that are not in pre-order
+        self.preorder = True
+        # id_dict is known to be in pre-order
+        self._preordered = False
+
+        # Record formats (FileType.records()): write an id -> offset index footer so get() and
+        # read_subtree() can go straight to the records they need
+        self.index_footer = False
+        # The footer and an mmap of the file, opened on first get()/read_subtree()
+        self.footer: records.FooterIndex = None
+        self._mmap: mmap.mmap = None
+        # the file's mtime/size when they were opened - a rewritten file is reopened
+        self._stamp = None
+        # SQLITE: get(), read_subtree() and select() query the database, opened on first use
+        self._db: "SqliteSnapshot" = None
+
+        # Per-dir subtree totals, built on first use by rollup()
+        self.rollups: Rollups = None
+        # Per-dir subtree digests, built on first use by merkle()
+        self.merkles: Merkle = None
+        # Secondary indexes over id_dict, built on first use by node_index()
+        self.index: NodeIndex = None
+
+        # Representation.COMPACT: translate() replaces the 3 views above with this
+        self.compact: CompactTree = None
     
+    @property
+    def treenode(self) -> Optional[TreeNode]:
+        if self._treenode is None and self._id_dict:
+            self._build_treenode()
+        return self._treenode
+
+    @treenode.setter
+    def treenode(self, value: TreeNode) -> None:
+        self._set_source(treenode=value)
+
+    @property
+    def id_dict(self) -> Dict[int, Node]:
+        if self._id_dict is None:
+            if self._treenode is not None:
+                self._build_dicts()
+            else:
+                self._id_dict = {}
+        return self._id_dict
+
+    @id_dict.setter
+    def id_dict(self, value: Dict[int, Node]) -> None:
+        self._set_source(id_dict=value)
+
+    @property
+    def tn_dict(self) -> Dict[int, TreeNode]:
+        if self._tn_dict is None:
+            if self._treenode is not None:
+                self._build_dicts()
+            elif self._id_dict:
+                self._build_treenode()
+            else:
+                self._tn_dict = {}
+        return self._tn_dict
+
+    @tn_dict.setter
+    def tn_dict(self, value: Dict[int, TreeNode]) -> None:
+        self._tn_dict = value
+
+    def _set_source(self, treenode: TreeNode = None, id_dict: Dict[int, Node] = None) -> None:
+        """ Replace the views with one source view - everything derived from the old one is dropped """
+        self._treenode = treenode
+        self._id_dict = id_dict
+        self._tn_dict = None
+        self._preordered = False
+        self.dict_list = None
+        self.rollups = None
+        self.merkles = None
+        self.index = None
+        self.compact = None
+        self.close()
+
+    def _build_dicts(self) -> None:
+        """ id_dict and tn_dict from the treenode - one pre-order pass """
+        id_dict = {}
+        tn_dict = {}
+        for tn in self._treenode.iter():
+            id_dict[tn.me.id] = tn.me
+            tn_dict[tn.me.id] = tn
+            for node in tn.files:
+                id_dict[node.id] = node
+        self._id_dict = id_dict
+        self._tn_dict = tn_dict
+        self._preordered = True
+
+    def _build_treenode(self) -> None:
+        """ treenode and tn_dict from the id_dict """
+        if self.preorder and self._translate_preorder():
+            # pre-order layout - one stack pass, no tn_dict lookups
+            return
+
+        # If serialization produces an id_dict, we must create the tn_dict
+        tn_dict = {}
+        for id, node in self._id_dict.items():
+            if node.is_dir():
+                tn_dict[id] = TreeNode(me=node, files=[], dirs=[])
+
+        # Define dir hierarchy
+        # Also identify root node to remove one tn_dict traversal
+        for tn in tn_dict.values():
+            if not tn.me.parent_id:
+                self._treenode = tn
+            else:
+                tn_dict[tn.me.parent_id].dirs.append(tn)
+
+        # Merge files into dir hierarchy
+        for node in self._id_dict.values():
+            if not node.is_dir():
+                tn_dict[node.parent_id].files.append(node)
+        self._tn_dict = tn_dict
+
     def _path(self, kind: FileType=None) -> str:
         if not kind:
             kind = self.filetype
         return kind.path(self.stem)
     
+    def _require_views(self, what: str) -> None:
+        if self.compact is not None:
+            raise ValueError(f"{what} needs the NamedTuple views - Representation.COMPACT released them")
+
+    def rollup(self) -> Rollups:
+        """
+        Per-dir subtree totals (size, files, dirs, newest mtime). Restored from the snapshot's
+        rollup sidecar when it is current, otherwise computed on demand.
+        """
+        if not self.rollups:
+            self._require_views("rollup()")
+            if not self.tn_dict:
+                self.translate()
+            self.rollups = Rollups(self.treenode, self.tn_dict)
+            if self.filetype.exists(self.stem):
+                self.rollups.load(self.filetype.sidecar(self.stem, "rollup"), self._path())
+        return self.rollups
+
+    def merkle(self) -> Merkle:
+        """
+        Per-dir subtree digests (see merkle). Restored from the snapshot's merkle sidecar
+        when it is current, otherwise computed on demand.
+        """
+        if not self.merkles:
+            self._require_views("merkle()")
+            if not self.tn_dict:
+                self.translate()
+            self.merkles = Merkle(self.treenode, self.tn_dict)
+            if self.filetype.exists(self.stem):
+                self.merkles.load(self.filetype.sidecar(self.stem, "merkle"), self._path())
+        return self.merkles
+
+    def node_index(self) -> NodeIndex:
+        """
+        Secondary indexes over id_dict. Restored from the snapshot's index sidecar when it
+        is current, otherwise each index is built the first time a query needs it.
+        """
+        if not self.index:
+            self._require_views("node_index()")
+            if not self.id_dict:
+                self.translate()
+            self.index = NodeIndex(self.id_dict)
+            if self.filetype.exists(self.stem):
+                self.index.load(self.filetype.sidecar(self.stem, "index"), self._path())
+        return self.index
+
     def to_dict_list(self):
         # TODO: If we choose a json, we could manually code a Node export format to avoid dict construction and encoding
         if not self.dict_list:
             self.dict_list = [x._asdict() for x in self.id_dict.values()]
         return self.dict_list
 
-    def _json_read(self, fn: str, load_func: Callable) -> Dict[int, Node]:
+    def _open_footer(self) -> records.FooterIndex:
+        if self.footer and sidecar.stamp(self._path()) != self._stamp:
+            self.close()
+        if not self.footer:
+            if not formats.get(self.filetype.value).records:
+                raise ValueError(f"Random access is not supported for {self.filetype}")
+            with open(self._path(), "rb") as f:
+                footer = records.read_footer(f)
+                if not footer:
+                    raise ValueError(f"{self._path()} has no index footer")
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._stamp = sidecar.stamp(self._path())
+            self.footer = footer
+        return self.footer
+
+    def close(self) -> None:
         """
-        Consolidate json logic here - so we can change it on all for any particular run
+        Release the files opened for random access (footer, mmap, database) - get(),
+        read_subtree() and select() reopen them
         """
-        with open(fn, "r") as f:
-            self.id_dict = {}
-            if self.json_dict_list:
-                for item in load_func(f):
-                    # safer cause key names are included, but slower
-                    self.id_dict[item['id']] = Node(**item)
-            else:
-                # this is the id_dict, serialzed which makes each node a Tuple - an ordered list
-                for v in load_func(f).values():
-                    self.id_dict[v[0]] = Node._make(v)
-        return self.id_dict
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self.footer = None
+        self._stamp = None
+        if self._db is not None:
+            self._db.close()
+        self._db = None
+
+    def _open_db(self) -> "SqliteSnapshot":
+        from sqlitedb import SqliteSnapshot
+        if not self._db:
+            self._db = SqliteSnapshot(self._path())
+        return self._db
+
+    def get(self, id: int) -> Node:
+        """
+        One node by id - from id_dict if loaded, else straight from the file's index footer
+        (or the database)
+        """
+        if self.id_dict:
+            return self.id_dict[id]
+        if self.filetype == FileType.SQLITE:
+            return self._open_db().get(id)
+        footer = self._open_footer()
+        start, end = footer.record_range(id)
+        return next(records.read_range(self._mmap, self.filetype.value, start, end, footer))
+
+    def read_subtree(self, dir_id: int) -> TreeNode:
+        """
+        A directory and all of its descendants, decoding only their contiguous byte range
+        (or fetching only their rows)
+        """
+        if self.filetype == FileType.SQLITE:
+            return TreeNode.from_preorder(self._open_db().subtree(dir_id))
+        footer = self._open_footer()
+        start, end = footer.subtree_range(dir_id)
+        return TreeNode.from_preorder(records.read_range(self._mmap, self.filetype.value, start, end, footer))
 
-    def _json_dump(self, fn: str, dump_func: Callable) -> None:
+    def read_lazy(self) -> List["LazyNode"]:
         """
-        Consolidate json logic here - so we can change it on all for any particular run
-
-        python's built in json looks to be the fastest of its type, but still 1/4 speed of pickle
-        Options
-        - Use the id_dict: NamedTuples serialize without key names so encoded data is a list of fields.
-          Every time we add/remove/change name/ change order, we break all archives - Basically the same
-          problems as pickle (except that encodes the structures as well).
-          BUT - it is 2x perf
-        - Use a list of NT._asdict. Slows speed to 1/2 of id_dict approach, but solves robustness problems
-        - Refactor out the NamedTuples. This avoids all the _asdict constructions, but living with it
-          would be much less pleasant
-        - Implement a c extension. What would we fix?
-
-        NOTE: this remains constant perf for all test cases. It beats pickle on the home case
-        TODO: decide on a best approach
+        BSON only: keep each document encoded (RawBSONDocument), fields are decoded on access
         """
-        with open(fn, "w") as f:
-            if self.json_dict_list:
-                dump_func(self.to_dict_list(), f, ensure_ascii=True)
-            else:
-                dump_func(self.id_dict, f, ensure_ascii=True)
+        if self.filetype != FileType.BSON:
+            raise ValueError(f"Lazy reads are not supported for {self.filetype}")
+        from bson import CodecOptions, decode_all
+        from bson.raw_bson import RawBSONDocument
+        from lazybson import LazyNode
+        with open(self._path(), "rb") as f:
+            # with RawBSONDocument, decode_all only splits the buffer into documents
+            docs = decode_all(records.record_stream(f).read(), CodecOptions(document_class=RawBSONDocument))
+        return [LazyNode(doc) for doc in docs]
+
+    def read_where(self, field: str, predicate: Callable[[Any], bool]) -> Dict[int, Node]:
+        """
+        BSON only: the nodes where predicate(node.field) is true, by id. Only field is
+        decoded for nodes that do not match. The views are left as they are.
+            c.read_where("size", lambda x: x > 1 << 20)
+        """
+        id_dict = {}
+        for lazy in self.read_lazy():
+            if predicate(getattr(lazy, field)):
+                node = lazy.to_node()
+                id_dict[node.id] = node
+        return id_dict
+
+    def export_neo4j(self, directory: str = None, shards: int = None, workers: int = 0) -> "Export":
+        """
+        Write the snapshot as neo4j-admin import CSVs, in shards - see neo4jcsv
+        :param directory: default ./data/neo4j/<stem>
+        """
+        import neo4jcsv
+        if not self.treenode:
+            self.translate()
+        return neo4jcsv.export(self.treenode, directory or f"./data/neo4j/{self.stem}", shards, workers)
 
-    def read(self) -> Union[Dict, TreeNode]:
+    def select(self, where: str, *params) -> Dict[int, Node]:
+        """
+        SQLITE only: the nodes matching an SQL where clause, by id - SQLite filters them.
+        The views are left as they are.
+            c.select("size > ?", 1 << 20)
+        """
+        if self.filetype != FileType.SQLITE:
+            raise ValueError(f"Queries are not supported for {self.filetype}")
+        return {node.id: node for node in self._open_db().select(where, *params)}
+
+    @contextmanager
+    def _open_codec(self, codec: formats.Codec, fn: str) -> Iterator[Union[IO, str]]:
+        """ fn opened for codec to read - or, for opens_path codecs, a path to the file """
+        if not codec.opens_path:
+            with self._open(fn, "rb" if codec.binary else "r", **codec.open_args) as f:
+                yield f
+        elif self._data is None:
+            yield fn
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = Path(tmp, Path(fn).name)
+                path.write_bytes(self._data)
+                yield str(path)
+
+    def _open(self, fn: str, mode: str, **kwargs) -> IO:
+        """ Open fn for reading - or the bytes passed to read(), if any """
+        if self._data is None:
+            return open(fn, mode, **kwargs)
+        f = io.BytesIO(self._data)
+        return f if "b" in mode else io.TextIOWrapper(f, **kwargs)
+
+    def read(self, data: bytes = None) -> Union[Dict, TreeNode]:
         """
         I return the best representation the source format supports
         pickle: TreeNode
         else  : Dict[inode -> properties]
+
+        :param data: the snapshot file's contents, already read - decode these instead of the file
         """
-        fn = self._path()
-        if self.filetype == FileType.PICKLE:
-            with open(fn, "rb") as f:
-                self.treenode = pickle.load(f)
-                return self.treenode
-        elif self.filetype == FileType.CSV:
-            self.id_dict = {}
-            with open(fn, "r") as f:
-                r = csv.DictReader(f)
-                for line in r:
-                    # type conversion
-                    for field in [k for k,v in Node._field_types.items() if v != str]:
-                        line[field] = int(line[field])
-                    self.id_dict[int(line['id'])] = Node(**line)
-                return self.id_dict
-        elif self.filetype == FileType.MSGPACK:
-            # TODO: This will fail with larger files - have to adjust max_xxx_len
-            with open(fn, "rb") as f:
-                self.id_dict = {}
-                for item in msgpack.unpack(f, raw=False):
-                    self.id_dict[item['id']] = Node(**item)
-            return self.id_dict
-        elif self.filetype == FileType.JSON:
-            return self._json_read(fn, json.load)
-        elif self.filetype == FileType.UJSON:
-            return self._json_read(fn, ujson.load)
-        elif self.filetype == FileType.SIMPLEJSON:
-            # NOTE: simplejson includes key names when serializing NamedTuples
-            with open(fn, "r") as f:
-                self.id_dict = {}
-                if self.json_dict_list:
-                    for item in simplejson.load(f):
-                        self.id_dict[item['id']] = Node(**item)
-                else:
-                    for v in simplejson.load(f).values():
-                        self.id_dict[v['id']] = Node(**v)
-            return self.id_dict
-        elif self.filetype == FileType.CBOR2:
-            with open(fn, "rb") as f:
-                self.id_dict = {}
-                for item in cbor2.load(f):
-                    self.id_dict[item['id']] = Node(**item)
-            return self.id_dict
-        elif self.filetype == FileType.CBOR:
-            with open(fn, "rb") as f:
-                self.id_dict = {}
-                for item in cbor.load(f):
-                    self.id_dict[item['id']] = Node(**item)
-            return self.id_dict
-        elif self.filetype == FileType.RAPIDJSON:
-            self.id_dict = {}
-            with open(fn, "r") as f:
-                d = rapidjson.Decoder(number_mode=rapidjson.NM_NATIVE)(f)
-                if self.json_dict_list:
-                    for item in d:
-                        # safer cause key names are included, but slower
-                        self.id_dict[item['id']] = Node(**item)
-                else:
-                    # list(self.id_dict.values()) - produces a list of lists
-                    for item in d:
-                        self.id_dict[item[0]] = Node._make(item)
-            return self.id_dict
-        elif self.filetype == FileType.BSON:
-            self.id_dict = {}
-            with open(fn, "rb") as f:
-                for doc in decode_file_iter(f):
-                    self.id_dict[doc['id']] = Node(**doc)
-            return self.id_dict
-
-    def write(self, kind: FileType) -> None:
+        codec = formats.get(self.filetype.value)
+        self._data = data
+        try:
+            with self._open_codec(codec, self._path()) as f:
+                codec.read(self, f)
+        finally:
+            self._data = None
+        return self._treenode if self._treenode is not None else self._id_dict
+
+    def stream(self) -> Iterator[Node]:
+        """ The snapshot's Nodes one at a time, without building any views """
+        codec = formats.get(self.filetype.value)
+        with self._open_codec(codec, self._path()) as f:
+            yield from codec.stream(self, f)
+
+    def write(self, kind: Union[FileType, Format]) -> None:
         fn = self._path(kind)
-        if kind == FileType.PICKLE:
-            # serialize as TreeNode
-            with open(fn, "wb") as f:
-                pickle.dump(self.treenode, f, protocol=-1)
-        elif kind == FileType.CSV:
-            # serialize as id_dict
-            with open(fn, "w") as f:
-                w = csv.DictWriter(f, Node._fields)
-                w.writeheader()
-                for item in self.treenode.node_iter():
-                    w.writerow(item._asdict())
-        elif kind == FileType.MSGPACK:
-            # https://msgpack-python.readthedocs.io/en/latest/api.html
-            with open(fn, "wb") as f:
-                # Doesn't improve speed
-                # msgpack.pack(self._to_dict(), f, use_bin_type=True)
-                msgpack.pack(self.to_dict_list(), f)
-        elif kind == FileType.JSON:
-            self._json_dump(fn, json.dump)
-        elif kind == FileType.UJSON:
-            self._json_dump(fn, ujson.dump)
-        elif kind == FileType.SIMPLEJSON:
-            # NOTE: simplejson includes key names when serializing NamedTuples
-            with open(fn, "w") as f:
-                if self.json_dict_list:
-                    simplejson.dump(list(self.id_dict.values()), f, ensure_ascii=True)
-                else:
-                    simplejson.dump(self.id_dict, f, ensure_ascii=True)
-        elif kind == FileType.CBOR2:
-            with open(fn, "wb") as f:
-                cbor2.dump(self.to_dict_list(), f)
-        elif kind == FileType.CBOR:
-            with open(fn, "wb") as f:
-                cbor.dump(self.to_dict_list(), f)
-        elif kind == FileType.RAPIDJSON:
-            # https://python-rapidjson.readthedocs.io/en/latest/benchmarks.html
-            # TODO: See this example for possible speed improvement - deeper integration with Node
-            #  https://python-rapidjson.readthedocs.io/en/latest/encoder.html
-            # NOTE: can't use id_dict - keys must be strings
-            #       can't use self.id_dict.values() - not serializable
-            #       list(self.id_dict.values()) produces a list of lists - no keys - very fragile
-            with open(fn, "w") as f:
-                if self.json_dict_list:
-                    rapidjson.Encoder(number_mode=rapidjson.NM_NATIVE, ensure_ascii=False)(self.to_dict_list(), f)
-                else:
-                    rapidjson.Encoder(number_mode=rapidjson.NM_NATIVE, ensure_ascii=False)(list(self.id_dict.values()), f)
-        elif kind == FileType.BSON:
-            with open(fn, "wb") as f:
-                co = CodecOptions(document_class=RawBSONDocument)
-                for node in self.treenode.node_iter():
-                    f.write(BSON.encode(node._asdict(), codec_options=co))
+        codec = formats.get(kind.value)
+        # the file may be the one open for random access - its footer would be stale
+        self.close()
+        compact = self.compact
+        if compact is not None:
+            # Representation.COMPACT released the views the codecs write from - rebuild them
+            # for this write only
+            self._set_source(treenode=compact.to_treenode())
+        try:
+            self._write(kind, fn, codec)
+        finally:
+            if compact is not None:
+                self._set_source()
+                self.compact = compact
+
+    def _write(self, kind: Union[FileType, Format], fn: str, codec: formats.Codec) -> None:
+        # PICKLE, PICKLE5, CSV/TSV, STRUCT, SQLITE and the record formats always write the treenode in pre-order
+        self._preorder_id_dict()
+        if codec.opens_path:
+            codec.write(self, fn)
+        else:
+            with open(fn, "wb" if codec.binary else "w", **codec.open_args) as f:
+                codec.write(self, f)
+
+        if self.rollups:
+            # persist what we have computed so far, get() fills in the rest on demand
+            self.rollups.save(kind.sidecar(self.stem, "rollup"), fn)
+        if self.merkles:
+            self.merkles.save(kind.sidecar(self.stem, "merkle"), fn)
+        if self.index:
+            self.index.save(kind.sidecar(self.stem, "index"), fn)
                 
         # TODO: Thrift?
         # TODO: arrow?
         # TODO: Node.to_json
 
+    def _translate_preorder(self) -> bool:
+        """ Build treenode, tn_dict from a pre-order id_dict. False if it is not in pre-order. """
+        tn_dict = {}
+        try:
+            self._treenode = TreeNode.from_preorder(self._id_dict.values(), tn_dict)
+        except ValueError:
+            return False
+        self._tn_dict = tn_dict
+        self._preordered = True
+        return True
+
+    def _preorder_id_dict(self) -> None:
+        """ With the pre-order layout, put id_dict in pre-order before writing it """
+        if self.preorder and not self._preordered and self.treenode:
+            self._build_dicts()
+            self.dict_list = None
+
     def translate(self):
         """
-        We serialize either a TreeNode or an id_dict. After reading, call
-        this method to ensure all source formats are available.
-        Assumes we have
+        We serialize either a TreeNode or an id_dict. The other views are built on first
+        access - call this method to build all of them now.
+
+        With Representation.COMPACT, the NamedTuple views are converted to a CompactTree
+        and released.
         """
-        if self.treenode:
-            # Create id_dict from TreeNode - only pickle
-            self.id_dict = self.treenode.to_id_dict()
-            self.tn_dict = self.treenode.to_tn_dict()
-        elif self.id_dict:
-            # Create TreeNode from id_dict - all other serializations
-            # If serialization produces an id_dict, we must create the tn_dict
-            self.tn_dict = {}
-            for id, node in self.id_dict.items():
-                if node.is_dir():
-                    self.tn_dict[id] = TreeNode(me=node, files=[], dirs=[])
-                    
-            # Define dir hierarchy
-            # Also identify root node to remove one tn_dict traversal
-            for tn in self.tn_dict.values():
-                if not tn.me.parent_id:
-                    self.treenode = tn
-                else:
-                    self.tn_dict[tn.me.parent_id].dirs.append(tn)
-                
-            # Merge files into dir hierarchy
-            for node in self.id_dict.values():
-                if not node.is_dir():
-                    self.tn_dict[node.parent_id].files.append(node)
-        else:
+        if self.compact is not None:
+            return
+        if self._treenode is None and not self._id_dict:
             raise ValueError("No internal format to translate.")
+        if self._treenode is None:
+            self._build_treenode()
+        elif self._id_dict is None or self._tn_dict is None:
+            self._build_dicts()
+
+        if self.representation == Representation.COMPACT:
+            compact = CompactTree.from_treenode(self.treenode)
+            self._set_source()
+            self.compact = compact
 
 
 def help():
@@ -376,10 +589,16 @@ def help():
 
 You can also use this script to translate one format to another and validate the translation
 
+Nodes stream from the import file to the export file through a bounded queue (see
+transcode), validated by comparing hashes of both node streams. --load reads the whole
+snapshot and writes it instead - with --validate, printing stats for both files.
+
 USE:
     Convert the case_100 test case from pickle to csv
       ./customs.py --case case_100 --import pickle --export csv
       ./customs.py --case case_5000 --import pickle --export csv
+    Decode in a separate process, then check the export's hash
+      ./customs.py --case case_5000 --import msgpack --export csv --processes --validate
 """
 
 
@@ -400,7 +619,15 @@ def main():
     parser.add_argument('-v', '--validate',
                        action='store_true',
                        default=False,
-                       help='print stats for both files')
+                       help='compare both files: node stream hashes - or stats for both files with --load')
+    parser.add_argument('-l', '--load',
+                       action='store_true',
+                       default=False,
+                       help='read the whole snapshot, then write it - instead of streaming')
+    parser.add_argument('-p', '--processes',
+                       action='store_true',
+                       default=False,
+                       help='stream: decode in a separate process, not a thread')
 
     args = parser.parse_args()
 
@@ -416,14 +643,31 @@ def main():
     if not ift.exists(args.case):
         print(f"Import file must exist: {ift.path(args.case)}")
         exit(1)
-     
+
+    eft = FileType(args.export_type)
+    if not args.load:
+        from transcode import transcode
+
+        def progress(nodes: int, seconds: float):
+            print(f"{nodes} nodes in {seconds:.1f} seconds, {nodes / seconds:.0f} nodes/sec")
+
+        r = transcode(args.case, ift, eft, validate=args.validate, processes=args.processes, progress=progress)
+        print(f"Transcoded {ift.path(args.case)} ({r.read_bytes} bytes) to {eft.path(args.case)} "
+              f"({r.written_bytes} bytes)")
+        print(f"{r.nodes} nodes in {r.seconds:.3f} seconds, {r.nodes_per_sec:.0f} nodes/sec"
+              + ("" if r.streamed else f" - {eft.value} collects the nodes to write them"))
+        if args.validate:
+            print(f"Hash {r.digest}: {'valid' if r.valid else 'MISMATCH'}")
+            if not r.valid:
+                exit(1)
+        return
+
     c = Customs(args.case, ift)
     start = timer()
     c1 = c.read()
     end = timer()
     print(f"Read {ift.path(args.case)} in {end-start:.3f} seconds")
 
-    eft = FileType(args.export_type)
     start = timer()
     c.write(eft)
     end = timer()
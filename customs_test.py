@@ -0,0 +1,65 @@
+"""
+Tests for customs module - lazily built views
+
+From project root:
+    pytest -s customs_test.py
+"""
+from unittest import TestCase
+
+from customs import Customs, FileType
+from tempdata import TempData
+
+
+class CustomsViewsTest(TestCase):
+
+    def setUp(self):
+        self.data = TempData("case_100")
+        self.addCleanup(self.data.cleanup)
+        self.c = Customs("case_100", FileType.PICKLE)
+        self.c.read()
+        self.c.translate()
+        self.c.write(FileType.JSON)
+
+    def test_pickle_views(self):
+        c = Customs("case_100", FileType.PICKLE)
+        c.read()
+        assert c._id_dict is None and c._tn_dict is None
+        # one pass builds both dicts
+        assert c.id_dict == self.c.treenode.to_id_dict()
+        assert c._tn_dict == self.c.treenode.to_tn_dict()
+        assert list(c.id_dict) == list(self.c.treenode.to_id_dict())
+
+    def test_json_views(self):
+        c = Customs("case_100", FileType.JSON)
+        c.read()
+        assert c.id_dict == self.c.id_dict
+        assert c._treenode is None and c._tn_dict is None
+        assert c.treenode == self.c.treenode
+        assert c.tn_dict == self.c.tn_dict
+
+        c = Customs("case_100", FileType.JSON)
+        c.read()
+        assert c.tn_dict == self.c.tn_dict
+        assert c._treenode == self.c.treenode
+
+    def test_invalidate(self):
+        c = Customs("case_100", FileType.JSON)
+        c.read()
+        c.translate()
+        c.to_dict_list()
+        c.rollup()
+        sub = self.c.treenode.dirs[0]
+        c.treenode = sub
+        assert c.dict_list is None and c.rollups is None
+        assert c.id_dict == sub.to_id_dict()
+        assert c.tn_dict == sub.to_tn_dict()
+
+        c.id_dict = dict(self.c.id_dict)
+        assert c.treenode == self.c.treenode
+
+    def test_empty(self):
+        c = Customs("case_100", FileType.JSON)
+        assert c.treenode is None
+        assert c.id_dict == {} and c.tn_dict == {}
+        with self.assertRaises(ValueError):
+            c.translate()